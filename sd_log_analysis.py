@@ -0,0 +1,467 @@
+'''
+Script Name:   sd_log_analysis.py
+Description:   Offline analysis of the JSON logs written to the SD card
+Date Created: October 2026
+Last Modified: October 2026
+Version:       1.0.0
+
+Overview:
+
+This script runs on a computer (CPython 3 + NumPy), not on the ESP32. It reads
+the `/sd/YYYY-M-D.json` files produced by `Communications.sdcard_write` in
+esp32_vl52l0x.py, where every line looks like:
+
+    {"interval": {"start": "...Z", "end": "...Z"},
+     "subjects": {"Sujeto 1": "0h 0m 12s 345 ms", ...}}
+
+and performs the following operations:
+- Streams every log into a NumPy structured array with one row per interval
+  (`start`, `end` as datetime64[s] and `occupancy` as int64 milliseconds per
+  sensor). Lines damaged by a power loss are skipped. The reader is chosen by
+  file extension (see READERS), so other log formats can be added.
+- Caches the parsed array next to the log as a .npy file, which is memory
+  mapped on later runs and only rebuilt when the size or modification time of
+  the log differ from the ones recorded when it was parsed.
+- Builds the per-sensor occupancy fraction and resamples it into fixed
+  periods (e.g. 15 min, 1 h, 1 day) with vectorized reductions.
+- Aggregates many days from many units, parsing the logs in a process pool.
+- Includes a benchmark that generates a synthetic archive and times it.
+
+Expected archive layout: one folder per unit with the files copied from its
+SD card, e.g. `logs/unit_a/2025-5-1.json`. The folder name is used as unit.
+
+Usage:
+    python sd_log_analysis.py logs --period 1h > hourly.csv
+    python sd_log_analysis.py --benchmark --units 10 --days 365
+'''
+# ------------------------ Imports and Configuration --------------------------
+import argparse
+import csv
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+CACHE_DIR_NAME = '.npcache'
+CACHE_VERSION = 1
+WORD_TO_REPORT = 'Sujeto'
+
+# Format produced by Communications.convert_data: '0h 0m 12s 345 ms'
+DURATION_PATTERN = re.compile(r'\d+h \d+m \d+s \d+ ms')
+DURATION_UNITS = str.maketrans('', '', 'hms')
+SUBJECT_PATTERN = re.compile(rf'{WORD_TO_REPORT} ([1-9]\d*)')
+# Format produced by Communications.get_iso_utc
+TIMESTAMP_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}Z')
+# Lines of a log decoded with a single json call while streaming it
+JSON_BLOCK_BYTES = 1 << 20
+DURATION_WEIGHTS = np.array([3600000, 60000, 1000, 1], dtype=np.int64)
+PERIOD_PATTERN = re.compile(r'^(\d+)\s*([smhdD])$')
+PERIOD_UNITS = {'s': 's', 'm': 'm', 'h': 'h', 'd': 'D', 'D': 'D'}
+
+
+# --------------------------- Parsing Functions -------------------------------
+# Returns the structured dtype used for a log with n_sensors sensors
+def log_dtype(n_sensors: int):
+    return np.dtype([
+        ('start', 'datetime64[s]'),
+        ('end', 'datetime64[s]'),
+        ('occupancy', np.int64, (n_sensors,)),
+    ])
+#end def
+
+# Converts '0h 0m 12s 345 ms' strings, already checked against
+# DURATION_PATTERN, into int64 milliseconds. Dropping the unit letters leaves
+# '0 0 12 345', which numpy reads in C.
+def durations_to_ms(durations: list):
+    text = ' '.join(durations).translate(DURATION_UNITS)
+    fields = np.fromstring(text, dtype=np.int64, sep=' ')
+    return fields.reshape(-1, 4) @ DURATION_WEIGHTS
+#end def
+
+# Decodes a block of JSON lines. A single json call is used for the whole
+# block; if it fails (e.g. a line truncated or garbled by a power loss) each
+# line is decoded on its own and the broken ones are skipped.
+def decode_json_lines(path: str, lines: list):
+    lines = [line for line in lines if line.strip()]
+    try:
+        # Invalid UTF-8 raises UnicodeDecodeError, a ValueError too
+        return json.loads(b'[' + b','.join(lines) + b']')
+    except ValueError:
+        entries = []
+        for line in lines:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                print(f'Skipping malformed line in {path}', file=sys.stderr)
+        return entries
+#end def
+
+# Reader for the JSON lines written by sdcard_write. Streams the decoded
+# lines of the log in blocks of about JSON_BLOCK_BYTES.
+def read_json_lines(path: str):
+    with open(path, 'rb') as f:
+        while True:
+            lines = f.readlines(JSON_BLOCK_BYTES)
+            if not lines:
+                break
+            yield from decode_json_lines(path, lines)
+#end def
+
+# Readers of every log format by file extension. A reader takes the path of a
+# log and yields its entries as decoded by the JSON format; a new format only
+# needs to add its reader here.
+READERS = {
+    '.json': read_json_lines,
+}
+
+# Returns the reader for a log from its extension
+def reader_for(path: str):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in READERS:
+        raise ValueError(f'Unsupported log format: {path}')
+    return READERS[extension]
+#end def
+
+# Converts a timestamp written by get_iso_utc into datetime64[s], or raises
+# ValueError if it is not one or is not a real date. Converted timestamps are
+# kept in stamps.
+def parse_timestamp(stamp, stamps: dict):
+    if not isinstance(stamp, str):
+        raise ValueError(f'invalid timestamp {stamp!r}')
+    value = stamps.get(stamp)
+    if value is None:
+        if not TIMESTAMP_PATTERN.fullmatch(stamp):
+            raise ValueError(f'invalid timestamp {stamp!r}')
+        try:
+            # numpy rejects the timezone designator, every timestamp is already UTC
+            value = stamps[stamp] = np.datetime64(stamp[:-1], 's')
+        except ValueError:
+            raise ValueError(f'invalid timestamp {stamp!r}') from None
+    return value
+#end def
+
+# Returns (start, end, columns, durations) of a decoded log line, or raises
+# ValueError if it does not have the format written by sdcard_write. layouts
+# and stamps keep the subject layouts and timestamps already parsed in the
+# log; the end of an interval is usually the start of the next one.
+def parse_entry(entry, layouts: dict, stamps: dict):
+    if not isinstance(entry, dict):
+        raise ValueError('entry is not an object')
+    interval, subjects = entry.get('interval'), entry.get('subjects')
+    if not isinstance(interval, dict) or not isinstance(subjects, dict):
+        raise ValueError('missing interval or subjects')
+    start = parse_timestamp(interval.get('start'), stamps)
+    end = parse_timestamp(interval.get('end'), stamps)
+    # Subjects are keyed by name since ujson does not keep their order. The
+    # columns of every key layout seen are computed once.
+    keys = tuple(subjects)
+    layout = layouts.get(keys)
+    if layout is None:
+        matches = [SUBJECT_PATTERN.fullmatch(key) for key in keys]
+        if not all(matches):
+            raise ValueError(f'invalid subject name in {list(keys)!r}')
+        layout = layouts[keys] = [int(match.group(1)) - 1 for match in matches]
+    durations = list(subjects.values())
+    for duration in durations:
+        if not isinstance(duration, str) or not DURATION_PATTERN.fullmatch(duration):
+            raise ValueError(f'invalid duration {duration!r}')
+    return start, end, layout, durations
+#end def
+
+# Parses a whole log into a structured array (see log_dtype). The reader is
+# chosen from the extension of the log unless one is given. Lines that do not
+# have the expected format are skipped, like the malformed JSON ones.
+def parse_log(path: str, reader=None):
+    if reader is None:
+        reader = reader_for(path)
+    starts, ends, counts, columns, durations = [], [], [], [], []
+    layouts, stamps = {}, {}
+    for entry in reader(path):
+        try:
+            start, end, layout, values = parse_entry(entry, layouts, stamps)
+        except ValueError as e:
+            print(f'Skipping invalid entry in {path}: {e}', file=sys.stderr)
+            continue
+        starts.append(start)
+        ends.append(end)
+        counts.append(len(layout))
+        columns.extend(layout)
+        durations.extend(values)
+    n_sensors = max(columns) + 1 if columns else 0
+    rows = np.repeat(np.arange(len(starts)), counts)
+    log = np.zeros(len(starts), dtype=log_dtype(n_sensors))
+    log['start'] = np.array(starts, dtype='datetime64[s]')
+    log['end'] = np.array(ends, dtype='datetime64[s]')
+    log['occupancy'][rows, columns] = durations_to_ms(durations)
+    return log
+#end def
+
+
+# ---------------------------- Cache Functions --------------------------------
+# Returns the .npy file used to cache a log. By default it is kept in a
+# folder next to the log, named after it, so the cache follows the archive
+# when it is moved. In a shared cache_dir the name also includes a hash of
+# the absolute path of the log, so logs with the same name from different
+# units never share a cache file.
+def cache_path(path: str, cache_dir: str = None):
+    path = os.path.abspath(path)
+    name = os.path.basename(path)
+    if cache_dir is None:
+        return os.path.join(os.path.dirname(path), CACHE_DIR_NAME, f'{name}.v{CACHE_VERSION}.npy')
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir, f'{name}.{digest}.v{CACHE_VERSION}.npy')
+#end def
+
+# Returns the size and modification time of a log, as written in the signature
+# file next to its cache
+def log_signature(path: str):
+    st = os.stat(path)
+    return f'{st.st_size} {st.st_mtime_ns}'
+#end def
+
+# True if the cache was built from a log with exactly the same size and
+# modification time. A newer or older timestamp alone is not trusted since
+# copies from the SD card usually keep the original (often wrong) times.
+def cache_is_valid(path: str, cache_file: str):
+    try:
+        with open(f'{cache_file}.sig', 'r') as f:
+            recorded = f.read().strip()
+        return os.path.exists(cache_file) and recorded == log_signature(path)
+    except OSError:
+        return False
+#end def
+
+# Writes a file through a temporary one so a reader never sees it half written
+def write_atomic(path: str, write):
+    tmp_file = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_file, 'wb') as f:
+        write(f)
+    os.replace(tmp_file, path)
+#end def
+
+# Parses a log and writes its cache if needed. Returns the cache file path
+def build_cache(path: str, cache_dir: str = None):
+    cache_file = cache_path(path, cache_dir)
+    if not cache_is_valid(path, cache_file):
+        # Taken before parsing: if the log grows meanwhile it is parsed again
+        signature = log_signature(path)
+        log = parse_log(path)
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        # The signature is written last, an interrupted update stays invalid
+        write_atomic(cache_file, lambda f: np.save(f, log))
+        write_atomic(f'{cache_file}.sig', lambda f: f.write(signature.encode('utf-8')))
+    return cache_file
+#end def
+
+# Returns the parsed log as a read-only memory mapped array
+def load_log(path: str, cache_dir: str = None):
+    return np.load(build_cache(path, cache_dir), mmap_mode='r')
+#end def
+
+# Loads many logs, parsing the ones without a valid cache in a process pool
+def load_logs(paths: list, cache_dir: str = None, workers: int = None):
+    cache_files = [cache_path(p, cache_dir) for p in paths]
+    stale = [p for p, c in zip(paths, cache_files) if not cache_is_valid(p, c)]
+    if len(stale) > 1 and workers != 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(stale) // (4 * (workers or os.cpu_count() or 1)))
+            list(pool.map(build_cache, stale, [cache_dir] * len(stale), chunksize=chunksize))
+    else:
+        for path in stale:
+            build_cache(path, cache_dir)
+    return [np.load(c, mmap_mode='r') for c in cache_files]
+#end def
+
+
+# --------------------------- Analysis Functions ------------------------------
+# Converts strings like '15m', '1h' or '1d' into numpy timedelta64
+def parse_period(period: str):
+    match = PERIOD_PATTERN.match(period.strip())
+    if not match:
+        raise ValueError(f'Invalid period: {period!r} (use e.g. 30s, 15m, 1h, 1d)')
+    if int(match.group(1)) <= 0:
+        raise ValueError(f'Invalid period: {period!r} (must be greater than zero)')
+    return np.timedelta64(int(match.group(1)), PERIOD_UNITS[match.group(2)])
+#end def
+
+# Joins several logs into a single one sorted by start time. Logs with fewer
+# sensors are padded with zero occupancy.
+def concatenate_logs(logs: list):
+    n_sensors = max((log.dtype['occupancy'].shape[0] if log.dtype['occupancy'].shape else 0
+                     for log in logs), default=0)
+    total = sum(len(log) for log in logs)
+    joined = np.zeros(total, dtype=log_dtype(n_sensors))
+    offset = 0
+    for log in logs:
+        n = len(log)
+        joined['start'][offset:offset + n] = log['start']
+        joined['end'][offset:offset + n] = log['end']
+        joined['occupancy'][offset:offset + n, :log['occupancy'].shape[1]] = log['occupancy']
+        offset += n
+    if total > 1 and np.any(np.diff(joined['start'].astype(np.int64)) < 0):
+        joined = joined[np.argsort(joined['start'], kind='stable')]
+    return joined
+#end def
+
+# Fraction of every interval in which each sensor detected a subject
+def occupancy_fraction(log):
+    duration_ms = (log['end'] - log['start']).astype('timedelta64[ms]').astype(np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fraction = log['occupancy'] / duration_ms[:, None]
+    fraction[~(duration_ms > 0)] = np.nan
+    return fraction
+#end def
+
+# Sums the occupancy and the measured time of a log into fixed periods. Each
+# interval is assigned to the period in which it starts. Returns the start of
+# every non-empty period, the occupancy (ms) per sensor and the measured time
+# (ms) per period; occupancy / measured gives the occupancy fraction.
+def resample(log, period):
+    if isinstance(period, str):
+        period = parse_period(period)
+    step = period.astype('timedelta64[s]').astype(np.int64)
+    if step <= 0:
+        raise ValueError(f'Invalid period: {period} (must be at least one second)')
+    start = log['start'].astype(np.int64)
+    if len(start) > 1 and np.any(np.diff(start) < 0):
+        order = np.argsort(start, kind='stable')
+        log, start = log[order], start[order]
+    bins = start // step
+    n_sensors = log['occupancy'].shape[1]
+    if len(bins) == 0:
+        return (np.zeros(0, dtype='datetime64[s]'),
+                np.zeros((0, n_sensors), dtype=np.int64),
+                np.zeros(0, dtype=np.int64))
+    first = np.concatenate(([0], np.flatnonzero(np.diff(bins)) + 1))
+    measured = (log['end'].astype(np.int64) - start) * 1000
+    occupancy = np.add.reduceat(np.asarray(log['occupancy']), first, axis=0)
+    measured = np.add.reduceat(measured, first)
+    return (bins[first] * step).astype('datetime64[s]'), occupancy, measured
+#end def
+
+# Finds the logs of an archive, grouped by unit (name of the containing folder)
+def find_logs(root: str):
+    units = {}
+    for folder, dirs, files in os.walk(root):
+        dirs[:] = sorted(d for d in dirs if d != CACHE_DIR_NAME)
+        logs = sorted(os.path.join(folder, f) for f in files
+                      if os.path.splitext(f)[1].lower() in READERS)
+        if logs:
+            unit = os.path.relpath(folder, root)
+            units[unit if unit != '.' else os.path.basename(os.path.abspath(root))] = logs
+    return units
+#end def
+
+# Resamples every unit of an archive. Returns {unit: resample(...)}
+def aggregate(root: str, period='1h', cache_dir: str = None, workers: int = None):
+    units = find_logs(root)
+    paths = [p for logs in units.values() for p in logs]
+    loaded = iter(load_logs(paths, cache_dir, workers))
+    result = {}
+    for unit, logs in units.items():
+        result[unit] = resample(concatenate_logs([next(loaded) for _ in logs]), period)
+    return result
+#end def
+
+# Writes the output of aggregate as CSV: unit, period start, fraction per sensor.
+# Every row has a column for every sensor of the archive; the columns of
+# sensors a unit does not have are left empty.
+def write_csv(result: dict, out=sys.stdout):
+    n_sensors = max((occ.shape[1] for _, occ, _ in result.values()), default=0)
+    header = ['unit', 'period_start', 'measured_s']
+    header += [f'{WORD_TO_REPORT} {i + 1}' for i in range(n_sensors)]
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(header)
+    for unit, (starts, occupancy, measured) in result.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            fraction = occupancy / measured[:, None]
+        padding = [''] * (n_sensors - occupancy.shape[1])
+        for stamp, total, row in zip(starts, measured, fraction):
+            values = [f'{v:.4f}' for v in row]
+            writer.writerow([unit, f'{stamp}Z', f'{total / 1000:g}'] + values + padding)
+#end def
+
+
+# --------------------------- Benchmark Functions -----------------------------
+# Returns one synthetic day of log lines with one entry every interval_s
+# seconds. Dates are left as '@D0@' (that day) and '@D1@' (the next one).
+def synthetic_day(n_sensors: int, interval_s: int, rng):
+    n = 86400 // interval_s
+    offsets = np.arange(n + 1) * interval_s
+    stamps = [f'{s // 3600 % 24:02d}:{s // 60 % 60:02d}:{s % 60:02d}Z' for s in offsets.tolist()]
+    days = ['@D0@'] * n + ['@D1@']
+    occupancy = rng.integers(0, interval_s * 1000, size=(n, n_sensors)).tolist()
+    lines = []
+    for i, row in enumerate(occupancy):
+        subjects = {}
+        for j, ms in enumerate(row):
+            s = ms // 1000
+            subjects[f'{WORD_TO_REPORT} {j + 1}'] = f'{s // 3600}h {s % 3600 // 60}m {s % 60}s {ms % 1000} ms'
+        interval = {'start': f'{days[i]}T{stamps[i]}', 'end': f'{days[i + 1]}T{stamps[i + 1]}'}
+        lines.append(json.dumps({'interval': interval, 'subjects': subjects}) + '\n')
+    return ''.join(lines)
+#end def
+
+# Generates an archive of units x days logs and times the cold (parsing) and
+# warm (memory mapped cache) aggregation
+def benchmark(units: int, days: int, n_sensors: int, interval_s: int, period: str, workers: int = None):
+    rng = np.random.default_rng(0)
+    template = synthetic_day(n_sensors, interval_s, rng)
+    first_day = np.datetime64('2025-01-01')
+    with tempfile.TemporaryDirectory() as root:
+        print(f'Generating {units} units x {days} days...', file=sys.stderr)
+        for u in range(units):
+            folder = os.path.join(root, f'unit_{u + 1}')
+            os.makedirs(folder)
+            for d in range(days):
+                day = first_day + np.timedelta64(d, 'D')
+                date = day.item()
+                # Same naming as Communications.get_date
+                name = f'{date.year}-{date.month}-{date.day}.json'
+                with open(os.path.join(folder, name), 'w') as f:
+                    f.write(template.replace('@D0@', str(day)).replace('@D1@', str(day + 1)))
+        entries = units * days * (86400 // interval_s)
+        t0 = time.perf_counter()
+        cold = aggregate(root, period, workers=workers)
+        t1 = time.perf_counter()
+        warm = aggregate(root, period, workers=workers)
+        t2 = time.perf_counter()
+        if cold.keys() != warm.keys() or not all(
+                np.array_equal(a, b) for u in cold for a, b in zip(cold[u], warm[u])):
+            raise RuntimeError('Results from the cache differ from the parsed logs')
+        print(f'{units * days} files, {entries} entries, {n_sensors} sensors')
+        print(f'cold (parse + cache): {t1 - t0:.2f} s ({entries / (t1 - t0):,.0f} entries/s)')
+        print(f'warm (memory mapped): {t2 - t1:.2f} s ({entries / (t2 - t1):,.0f} entries/s)')
+#end def
+
+
+# ------------------------------ Main Function --------------------------------
+def main():
+    parser = argparse.ArgumentParser(description='Occupancy analysis of SD card JSON logs')
+    parser.add_argument('root', nargs='?', help='archive folder, one sub folder per unit')
+    parser.add_argument('--period', default='1h', help='resampling period, e.g. 15m, 1h, 1d')
+    parser.add_argument('--workers', type=int, default=None, help='parsing processes')
+    parser.add_argument('--cache-dir', default=None, help='cache folder (default: next to each log)')
+    parser.add_argument('--benchmark', action='store_true', help='time a synthetic archive')
+    parser.add_argument('--units', type=int, default=10, help='benchmark: number of units')
+    parser.add_argument('--days', type=int, default=365, help='benchmark: days per unit')
+    parser.add_argument('--sensors', type=int, default=2, help='benchmark: sensors per unit')
+    parser.add_argument('--interval', type=int, default=60, help='benchmark: seconds between entries (TIME2SEND)')
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.units, args.days, args.sensors, args.interval, args.period, args.workers)
+    elif args.root:
+        write_csv(aggregate(args.root, args.period, args.cache_dir, args.workers))
+    else:
+        parser.error('an archive folder or --benchmark is required')
+#end def
+
+# Entry point wrapper
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,244 @@
+import io
+import json
+import os
+
+import numpy as np
+import pytest
+
+import sd_log_analysis as sla
+
+
+def entry(start, end, **subjects):
+    return json.dumps({
+        'interval': {'start': start, 'end': end},
+        'subjects': {key.replace('_', ' '): value for key, value in subjects.items()},
+    })
+
+
+def write_log(path, lines):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(''.join(line + '\n' for line in lines))
+
+
+# ------------------------------ Durations ------------------------------------
+def test_parse_log_durations(tmp_path):
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    write_log(path, [
+        entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 12s 345 ms'),
+        entry('2025-05-01T10:01:00Z', '2025-05-01T10:02:00Z', Sujeto_1='1h 2m 3s 4 ms'),
+        entry('2025-05-01T10:02:00Z', '2025-05-01T10:03:00Z', Sujeto_1='0h 0m 0s 0 ms'),
+    ])
+    assert sla.parse_log(path)['occupancy'].tolist() == [[12345], [3723004], [0]]
+
+
+@pytest.mark.parametrize('durations', [
+    ['0h 0m x', '0h 0m 1s 0 ms'],
+    ['1h 2m', '3s 4 ms 5'],
+    ['5 hms 3 4 5', '0h 0m 1s 0 ms'],
+    ['0h 0m 1s 2 ms\n0h 0m 1s 2 ms', '0h 0m 1s 0 ms'],
+    ['0h 0m 1s 2 ms', '0h 0m 1s 2ms'],
+    [1000, '0h 0m 1s 0 ms'],
+])
+def test_parse_log_skips_malformed_durations(tmp_path, durations):
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    good = entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z',
+                 Sujeto_1='0h 0m 1s 0 ms', Sujeto_2='0h 0m 2s 0 ms')
+    bad = entry('2025-05-01T10:01:00Z', '2025-05-01T10:02:00Z',
+                Sujeto_1=durations[0], Sujeto_2=durations[1])
+    write_log(path, [good, bad, good])
+    assert sla.parse_log(path)['occupancy'].tolist() == [[1000, 2000], [1000, 2000]]
+
+
+# ------------------------------ parse_log ------------------------------------
+def test_parse_log_out_of_order_keys_and_missing_sensors(tmp_path):
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    write_log(path, [
+        entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z',
+              Sujeto_2='0h 0m 1s 500 ms', Sujeto_1='0h 1m 0s 0 ms'),
+        entry('2025-05-01T10:01:00Z', '2025-05-01T10:02:00Z', Sujeto_3='0h 0m 0s 7 ms'),
+    ])
+    log = sla.parse_log(path)
+    assert log['occupancy'].tolist() == [[60000, 1500, 0], [0, 0, 7]]
+    assert log['start'][1] == np.datetime64('2025-05-01T10:01:00')
+    assert log['end'][0] == np.datetime64('2025-05-01T10:01:00')
+
+
+def test_parse_log_skips_invalid_entries(tmp_path, capsys):
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    good = entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms')
+    write_log(path, [
+        good,
+        json.dumps({'subjects': {'Sujeto 1': '0h 0m 1s 0 ms'}}),
+        json.dumps({'interval': {'start': '2025-05-01T10:00:00Z', 'end': '2025-05-01T10:01:00Z'},
+                    'subjects': ['0h 0m 1s 0 ms']}),
+        entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Other_1='0h 0m 1s 0 ms'),
+        entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='1h 2m'),
+        entry('yesterday', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms'),
+        entry('2025-13-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms'),
+        entry('2025-05-01T10:00:00Z', '2025-05-01T25:00:00Z', Sujeto_1='0h 0m 1s 0 ms'),
+        entry('2025-02-30T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms'),
+        entry('2025-05-01T10:00:00', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms'),
+        entry(['2025-05-01T10:00:00Z'], '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms'),
+        '[1, 2]',
+        '{"interval": {"start": "2025-05-01T11:00:00Z", "end": "2025',
+        good,
+    ])
+    log = sla.parse_log(path)
+    assert log['occupancy'].tolist() == [[1000], [1000]]
+    err = capsys.readouterr().err
+    assert err.count(path) == 12
+
+
+def test_parse_log_skips_invalid_utf8(tmp_path, capsys):
+    path = tmp_path / 'u' / '2025-5-1.json'
+    good = entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms')
+    write_log(str(path), [good])
+    with open(path, 'ab') as f:
+        f.write(b'{"interval": \xff\xfe\x00garbage\n')
+        f.write(good.encode('utf-8') + b'\n')
+    log = sla.parse_log(str(path))
+    assert log['occupancy'].tolist() == [[1000], [1000]]
+    assert str(path) in capsys.readouterr().err
+
+
+def test_parse_log_streams_in_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(sla, 'JSON_BLOCK_BYTES', 1)
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    write_log(path, [
+        entry('2025-05-01T10:0%d:00Z' % i, '2025-05-01T10:0%d:00Z' % (i + 1), Sujeto_1='0h 0m %ds 0 ms' % i)
+        for i in range(5)])
+    assert sla.parse_log(path)['occupancy'].tolist() == [[0], [1000], [2000], [3000], [4000]]
+
+
+def test_readers_by_extension(tmp_path, monkeypatch):
+    def read_csv(path):
+        with open(path) as f:
+            for line in f:
+                start, end, ms = line.strip().split(',')
+                yield {'interval': {'start': start, 'end': end},
+                       'subjects': {'Sujeto 1': f'0h 0m 0s {ms} ms'}}
+
+    monkeypatch.setitem(sla.READERS, '.csv', read_csv)
+    write_log(str(tmp_path / 'logs' / 'u' / '2025-5-1.csv'), ['2025-05-01T10:00:00Z,2025-05-01T10:01:00Z,7'])
+    write_log(str(tmp_path / 'logs' / 'u' / 'notes.txt'), ['not a log'])
+    assert list(sla.find_logs(str(tmp_path / 'logs'))['u']) == [str(tmp_path / 'logs' / 'u' / '2025-5-1.csv')]
+    assert sla.aggregate(str(tmp_path / 'logs'), '1h', workers=1)['u'][1].tolist() == [[7]]
+    with pytest.raises(ValueError):
+        sla.parse_log(str(tmp_path / 'logs' / 'u' / 'notes.txt'))
+
+
+# ------------------------------- Analysis ------------------------------------
+def make_log(starts, occupancy, length_s=60):
+    occupancy = np.array(occupancy, dtype=np.int64)
+    log = np.zeros(len(starts), dtype=sla.log_dtype(occupancy.shape[1]))
+    log['start'] = np.array(starts, dtype='datetime64[s]')
+    log['end'] = log['start'] + np.timedelta64(length_s, 's')
+    log['occupancy'] = occupancy
+    return log
+
+
+def test_parse_period():
+    assert sla.parse_period('15m') == np.timedelta64(15, 'm')
+    assert sla.parse_period('1d') == np.timedelta64(1, 'D')
+    for period in ['0h', '00m', '-1h', '1w', 'h']:
+        with pytest.raises(ValueError):
+            sla.parse_period(period)
+
+
+def test_resample_bin_edges():
+    log = make_log(
+        ['2025-05-01T10:59:59', '2025-05-01T10:00:00', '2025-05-01T11:00:00', '2025-05-01T13:30:00'],
+        [[1], [2], [4], [8]])
+    starts, occupancy, measured = sla.resample(log, '1h')
+    assert starts.tolist() == np.array(
+        ['2025-05-01T10:00:00', '2025-05-01T11:00:00', '2025-05-01T13:00:00'],
+        dtype='datetime64[s]').tolist()
+    assert occupancy.tolist() == [[3], [4], [8]]
+    assert measured.tolist() == [120000, 60000, 60000]
+
+
+def test_resample_empty():
+    starts, occupancy, measured = sla.resample(make_log([], np.zeros((0, 2))), '1h')
+    assert len(starts) == len(measured) == 0
+    assert occupancy.shape == (0, 2)
+
+
+def test_concatenate_logs_pads_sensors_and_sorts():
+    a = make_log(['2025-05-02T00:00:00'], [[1, 2, 3]])
+    b = make_log(['2025-05-01T00:00:00'], [[4]])
+    joined = sla.concatenate_logs([a, b])
+    assert joined['occupancy'].tolist() == [[4, 0, 0], [1, 2, 3]]
+    assert joined['start'][0] == np.datetime64('2025-05-01T00:00:00')
+
+
+def test_occupancy_fraction():
+    log = make_log(['2025-05-01T00:00:00', '2025-05-01T00:01:00'], [[30000], [60000]])
+    log['end'][1] = log['start'][1]
+    fraction = sla.occupancy_fraction(log)
+    assert fraction[0, 0] == 0.5
+    assert np.isnan(fraction[1, 0])
+
+
+# -------------------------------- Cache --------------------------------------
+def test_cache_names_do_not_collide(tmp_path):
+    a = str(tmp_path / 'logs' / 'unit,a' / '2025-5-1.json')
+    b = str(tmp_path / 'logs' / 'unit_b' / '2025-5-1.json')
+    write_log(a, [entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z',
+                        Sujeto_1='0h 0m 30s 0 ms', Sujeto_2='0h 0m 0s 0 ms')])
+    write_log(b, [entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 1m 0s 0 ms')])
+    cache_dir = str(tmp_path / 'cache')
+    assert sla.cache_path(a, cache_dir) != sla.cache_path(b, cache_dir)
+    result = sla.aggregate(str(tmp_path / 'logs'), '1h', cache_dir=cache_dir)
+    assert result['unit,a'][1].tolist() == [[30000, 0]]
+    assert result['unit_b'][1].tolist() == [[60000]]
+
+
+def test_default_cache_survives_moving_the_archive(tmp_path):
+    path = str(tmp_path / 'logs' / 'u' / '2025-5-1.json')
+    write_log(path, [entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms')])
+    sla.load_log(path)
+    os.rename(tmp_path / 'logs', tmp_path / 'moved')
+    moved = str(tmp_path / 'moved' / 'u' / '2025-5-1.json')
+    assert sla.cache_is_valid(moved, sla.cache_path(moved))
+    assert sorted(os.listdir(tmp_path / 'moved' / 'u' / sla.CACHE_DIR_NAME)) == [
+        '2025-5-1.json.v1.npy', '2025-5-1.json.v1.npy.sig']
+
+
+def test_cache_invalidated_by_size_even_with_old_mtime(tmp_path):
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    first = entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms')
+    write_log(path, [first])
+    assert len(sla.load_log(path)) == 1
+    assert len(sla.load_log(path)) == 1
+    with open(path, 'a') as f:
+        f.write(entry('2025-05-01T10:01:00Z', '2025-05-01T10:02:00Z', Sujeto_1='0h 0m 2s 0 ms') + '\n')
+    # Copies from the SD card often keep an old timestamp
+    os.utime(path, (1e9, 1e9))
+    assert len(sla.load_log(path)) == 2
+
+
+def test_cache_invalidated_by_mtime(tmp_path):
+    path = str(tmp_path / 'u' / '2025-5-1.json')
+    write_log(path, [entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 1s 0 ms')])
+    assert sla.load_log(path)['occupancy'].tolist() == [[1000]]
+    # Same size, different content
+    write_log(path, [entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 0m 2s 0 ms')])
+    os.utime(path, (2e9, 2e9))
+    assert sla.load_log(path)['occupancy'].tolist() == [[2000]]
+
+
+# --------------------------------- CSV ---------------------------------------
+def test_write_csv_pads_sensors_and_quotes_units(tmp_path):
+    write_log(str(tmp_path / 'logs' / 'unit,a' / '2025-5-1.json'), [
+        entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z',
+              Sujeto_1='0h 0m 30s 0 ms', Sujeto_2='0h 0m 15s 0 ms')])
+    write_log(str(tmp_path / 'logs' / 'unit_b' / '2025-5-1.json'), [
+        entry('2025-05-01T10:00:00Z', '2025-05-01T10:01:00Z', Sujeto_1='0h 1m 0s 0 ms')])
+    out = io.StringIO()
+    sla.write_csv(sla.aggregate(str(tmp_path / 'logs'), '1h', workers=1), out)
+    assert out.getvalue().splitlines() == [
+        'unit,period_start,measured_s,Sujeto 1,Sujeto 2',
+        '"unit,a",2025-05-01T10:00:00Z,60,0.5000,0.2500',
+        'unit_b,2025-05-01T10:00:00Z,60,1.0000,',
+    ]